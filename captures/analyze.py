@@ -1,185 +1,373 @@
 #!/usr/bin/env python3
 """Analyze decoded TachTalk capture files for response anomalies."""
 
-import re
+import argparse
+import functools
+import io
+import os
+import pickle
 import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+_TYPES = frozenset(("TX", "RX", "CONNECT", "DISCONNECT"))
+_PROMPTS = frozenset((r"\r>", r"\r\r>"))
+# Bump when the pickled capture layout changes, to invalidate old caches.
+_CACHE_VERSION = 3
 
-def parse_captures(text):
-    """Split decoded output into per-capture record lists."""
-    parts = re.split(r"^=== (capture_.*?\.ttcap) ===$", text, flags=re.MULTILINE)
-    captures = []
-    for i in range(1, len(parts), 2):
-        name = parts[i]
-        content = parts[i + 1]
-        records = []
-        for line in content.split("\n"):
-            m = re.match(
-                r"\s+(\d+)\s+(\d+)\s+(TX|RX|CONNECT|DISCONNECT)\s+(\d+)\s+(.*)",
-                line,
+
+def _build_hex2():
+    """Map every 2-char string that int(s, 16) accepts to its value."""
+    table = {}
+    chars = "0123456789abcdefABCDEF +-"
+    for a in chars:
+        for b in chars:
+            try:
+                table[a + b] = int(a + b, 16)
+            except ValueError:
+                pass
+    return table
+
+
+_HEX2 = _build_hex2()
+
+
+def _new_capture(name):
+    return {
+        "name": name,
+        "nums": [],
+        "times": [],
+        "types": [],
+        "bytes": [],
+        "datas": [],
+        "has_count": [],
+    }
+
+
+def parse_captures(lines):
+    """Yield per-capture record columns from decoded output, one at a time.
+
+    Each capture holds parallel lists (nums, times, types, bytes, datas,
+    has_count), indexed by record position. has_count flags TX records
+    that carry the ELM327 " 1" response-count suffix. Only the current
+    capture is held in memory, so this can be fed straight from an open
+    file.
+    """
+    cap = None
+    for line in lines:
+        # Capture header: "=== capture_<...>.ttcap ==="
+        if line.startswith("=== capture_"):
+            header = line.rstrip("\n")
+            if header.endswith(".ttcap ==="):
+                if cap is not None:
+                    yield cap
+                cap = _new_capture(header[4:-4])
+                add_num = cap["nums"].append
+                add_time = cap["times"].append
+                add_type = cap["types"].append
+                add_bytes = cap["bytes"].append
+                add_data = cap["datas"].append
+                add_has_count = cap["has_count"].append
+                continue
+        if cap is None:
+            continue
+        # Record lines are right-aligned columns:
+        #   "<num>  <time>  <type>  <bytes>  <data>"
+        fields = line.split(None, 4)
+        if len(fields) != 5 or fields[2] not in _TYPES or not line[:1].isspace():
+            continue
+        num, time, type_, nbytes, data = fields
+        if num.isdecimal() and time.isdecimal() and nbytes.isdecimal():
+            add_num(int(num))
+            add_time(int(time))
+            add_type(type_)
+            add_bytes(int(nbytes))
+            data = data.rstrip()
+            add_data(data)
+            add_has_count(type_ == "TX" and " 1\\r" in data)
+    if cap is not None:
+        yield cap
+
+
+def _check_cache(f, key):
+    """Return "hit", "stale" or "damaged" for the cache file f and key."""
+    try:
+        if pickle.load(f) != key:
+            return "stale"
+        while True:
+            try:
+                pickle.load(f)
+            except EOFError:
+                return "hit"
+    except Exception:
+        return "damaged"
+
+
+def cached_captures(path, cache_path):
+    """Yield captures from path, via a pickle cache when it is up to date."""
+    st = path.stat()
+    key = (_CACHE_VERSION, st.st_mtime_ns, st.st_size)
+
+    try:
+        f = cache_path.open("rb")
+    except OSError:
+        pass
+    else:
+        with f:
+            # Read the whole cache through once before yielding anything, so
+            # a damaged cache falls back to parsing without repeating reports
+            status = _check_cache(f, key)
+            if status == "hit":
+                f.seek(0)
+                pickle.load(f)
+                while True:
+                    try:
+                        yield pickle.load(f)
+                    except EOFError:
+                        return
+        if status == "damaged":
+            print(
+                f"Warning: {cache_path} is damaged, rebuilding it",
+                file=sys.stderr,
             )
-            if m:
-                records.append(
-                    {
-                        "num": int(m.group(1)),
-                        "time": int(m.group(2)),
-                        "type": m.group(3),
-                        "bytes": int(m.group(4)),
-                        "data": m.group(5).strip(),
-                    }
-                )
-        captures.append({"name": name, "records": records})
-    return captures
+            try:
+                cache_path.unlink()
+            except OSError:
+                pass
+
+    with path.open() as f:
+        try:
+            out = tempfile.NamedTemporaryFile(
+                dir=cache_path.parent,
+                prefix=cache_path.name + ".",
+                suffix=".tmp",
+                delete=False,
+            )
+        except OSError:
+            yield from parse_captures(f)
+            return
+
+        tmp_path = Path(out.name)
+        # Any write error just stops caching; captures keep being yielded
+        caching = True
+        complete = False
+        try:
+            try:
+                pickle.dump(key, out, protocol=5)
+            except OSError:
+                caching = False
+            for cap in parse_captures(f):
+                if caching:
+                    try:
+                        pickle.dump(cap, out, protocol=5)
+                    except OSError:
+                        caching = False
+                yield cap
+            complete = True
+        finally:
+            try:
+                out.close()
+            except OSError:
+                caching = False
+            saved = False
+            if caching and complete:
+                try:
+                    os.replace(tmp_path, cache_path)
+                    saved = True
+                except OSError:
+                    pass
+            if not saved:
+                tmp_path.unlink(missing_ok=True)
 
 
 def analyze_capture(cap):
-    """Print anomaly analysis for one capture."""
-    recs = cap["records"]
-    tx_recs = [r for r in recs if r["type"] == "TX"]
-    rx_recs = [r for r in recs if r["type"] == "RX"]
+    """Return the anomaly analysis report for one capture."""
+    buf = io.StringIO()
+    emit = functools.partial(print, file=buf)
+    nums = cap["nums"]
+    times = cap["times"]
+    types = cap["types"]
+    nbytes = cap["bytes"]
+    datas = cap["datas"]
+    has_count = cap["has_count"]
+    tx_idx = []
+    rx_idx = []
+    for i, t in enumerate(types):
+        if t == "TX":
+            tx_idx.append(i)
+        elif t == "RX":
+            rx_idx.append(i)
+
+    # All per-RX counters and filters, in a single pass over rx_idx
+    split_prompt = 0
+    prompt_with_data = 0
+    searching = 0
+    no_data = 0
+    h1_responses = []
+    multi_pid_rx = []
+    for i in rx_idx:
+        d = datas[i]
+        if d in _PROMPTS:
+            split_prompt += 1
+        if ">" in d:
+            if len(d) > 5:
+                prompt_with_data += 1
+            if "410C" in d and "05" in d:
+                multi_pid_rx.append(d)
+        if "SEARCHING" in d:
+            searching += 1
+        if "NO DATA" in d:
+            no_data += 1
+        if "7E8" in d:
+            h1_responses.append(d)
 
-    print(f"=== {cap['name']} ===")
+    emit(f"=== {cap['name']} ===")
 
     # ---- ATZ response ----
-    for j, r in enumerate(recs):
-        if r["type"] == "TX" and "ATZ" in r["data"]:
-            for k in range(j + 1, min(j + 5, len(recs))):
-                if recs[k]["type"] == "RX":
-                    print(
-                        f"  ATZ response: {recs[k]['data']!r}"
-                        f" ({recs[k]['bytes']} bytes)"
-                    )
-                    break
-            break
+    atz = next((i for i in tx_idx if "ATZ" in datas[i]), None)
+    if atz is not None:
+        for k in range(atz + 1, min(atz + 5, len(types))):
+            if types[k] == "RX":
+                emit(f"  ATZ response: {datas[k]!r} ({nbytes[k]} bytes)")
+                break
 
     # ---- Split vs combined prompt delivery ----
-    split_prompt = sum(
-        1
-        for r in rx_recs
-        if r["data"] in (r"\r>", r"\r\r>")
-    )
-    prompt_with_data = sum(
-        1
-        for r in rx_recs
-        if ">" in r["data"] and len(r["data"]) > 5
-    )
-    print(f"  Split prompt (separate '\\r>' read): {split_prompt}")
-    print(f"  Prompt combined with data: {prompt_with_data}")
+    emit(f"  Split prompt (separate '\\r>' read): {split_prompt}")
+    emit(f"  Prompt combined with data: {prompt_with_data}")
 
     # ---- SEARCHING / NO DATA ----
-    searching = sum(1 for r in rx_recs if "SEARCHING" in r["data"])
-    no_data = sum(1 for r in rx_recs if "NO DATA" in r["data"])
-    print(f"  SEARCHING... responses: {searching}")
-    print(f"  NO DATA responses: {no_data}")
+    emit(f"  SEARCHING... responses: {searching}")
+    emit(f"  NO DATA responses: {no_data}")
 
-    # ---- Commands with >1 TCP read per response ----
+    # ---- Commands with >1 TCP read per response, round-trip times ----
+    # One forward sweep: count RX reads between consecutive TXs, and pair
+    # each OBD TX with the first RX within the next 4 records.
     multi_rx = 0
-    for j in range(len(recs)):
-        if recs[j]["type"] == "TX":
-            rx_count = 0
-            for k in range(j + 1, len(recs)):
-                if recs[k]["type"] == "TX":
-                    break
-                if recs[k]["type"] == "RX":
-                    rx_count += 1
-            if rx_count > 1:
+    rx_count = None
+    rts_with_count = []
+    rts_without_count = []
+    pending = []
+    for j, (t, ts) in enumerate(zip(types, times)):
+        if t == "TX":
+            if rx_count is not None and rx_count > 1:
                 multi_rx += 1
-    print(f"  Commands with split RX (>1 read per response): {multi_rx}")
+            rx_count = 0
+            if not datas[j].startswith("AT"):
+                rts = rts_with_count if has_count[j] else rts_without_count
+                pending.append((j, ts, rts))
+        elif t == "RX":
+            if rx_count is not None:
+                rx_count += 1
+            for _, tx_time, rts in pending:
+                rts.append(ts - tx_time)
+            pending.clear()
+        while pending and j - pending[0][0] >= 4:
+            pending.pop(0)
+    if rx_count is not None and rx_count > 1:
+        multi_rx += 1
+    emit(f"  Commands with split RX (>1 read per response): {multi_rx}")
 
     # ---- ATH1 PCI byte verification ----
-    h1_responses = [r for r in rx_recs if "7E8" in r["data"]]
     if h1_responses:
         pci_issues = []
-        for r in h1_responses:
-            d = r["data"].replace(r"\r\r>", "").replace(r"\r>", "")
+        for d in h1_responses:
+            d = d.replace(r"\r\r>", "").replace(r"\r>", "")
             if len(d) >= 5:
-                pci_hex = d[3:5]
-                data_after_pci = d[5:]
-                try:
-                    pci = int(pci_hex, 16)
-                    actual_bytes = len(data_after_pci) // 2
-                    if pci != actual_bytes:
-                        pci_issues.append(
-                            f"PCI={pci}, actual={actual_bytes}, line={d!r}"
-                        )
-                except ValueError:
-                    pass
-        print(
+                pci = _HEX2.get(d[3:5])
+                if pci is None:
+                    continue
+                actual_bytes = (len(d) - 5) // 2
+                if pci != actual_bytes:
+                    pci_issues.append(
+                        f"PCI={pci}, actual={actual_bytes}, line={d!r}"
+                    )
+        emit(
             f"  ATH1 responses: {len(h1_responses)},"
             f" PCI mismatches: {len(pci_issues)}"
         )
         for issue in pci_issues[:5]:
-            print(f"    {issue}")
+            emit(f"    {issue}")
 
     # ---- Multi-PID response format ----
-    multi_pid_rx = [
-        r
-        for r in rx_recs
-        if "410C" in r["data"] and "05" in r["data"] and ">" in r["data"]
-    ]
     if multi_pid_rx:
-        print(f"  Multi-PID combined responses (010C+05): {len(multi_pid_rx)}")
-        for r in multi_pid_rx[:3]:
-            print(f"    Example: {r['data']!r}")
+        emit(f"  Multi-PID combined responses (010C+05): {len(multi_pid_rx)}")
+        for d in multi_pid_rx[:3]:
+            emit(f"    Example: {d!r}")
 
     # ---- Count suffix transition ----
-    obd_tx = [r for r in tx_recs if not r["data"].startswith("AT")]
-    with_count = [r for r in obd_tx if " 1\\r" in r["data"]]
-    without_count = [r for r in obd_tx if " 1\\r" not in r["data"]]
+    obd_tx = [i for i in tx_idx if not datas[i].startswith("AT")]
+    with_count = [i for i in obd_tx if has_count[i]]
+    without_count = len(obd_tx) - len(with_count)
     if with_count and without_count:
-        print(f"  Commands without count suffix: {len(without_count)}")
-        print(f"  Commands with ' 1' suffix: {len(with_count)}")
-
-        # Find the transition point
-        for j, r in enumerate(obd_tx):
-            if " 1\\r" in r["data"]:
-                prev = obd_tx[j - 1] if j > 0 else None
-                if prev and " 1\\r" not in prev["data"]:
-                    print(
-                        f"  Mode transition at record #{r['num']}"
-                        f" (t={r['time']}ms)"
-                    )
-                break
+        emit(f"  Commands without count suffix: {without_count}")
+        emit(f"  Commands with ' 1' suffix: {len(with_count)}")
 
-    # ---- Timing: round-trip with vs without count ----
-    for label, subset in [("without count", without_count), ("with count", with_count)]:
-        if not subset:
-            continue
-        rts = []
-        for r in subset:
-            idx = next(
-                (i for i, rec in enumerate(recs) if rec["num"] == r["num"]), None
+        # The transition is the first counted command, unless it was also
+        # the first OBD command overall
+        first = with_count[0]
+        if first != obd_tx[0]:
+            emit(
+                f"  Mode transition at record #{nums[first]}"
+                f" (t={times[first]}ms)"
             )
-            if idx is None:
-                continue
-            for k in range(idx + 1, min(idx + 5, len(recs))):
-                if recs[k]["type"] == "RX":
-                    rts.append(recs[k]["time"] - r["time"])
-                    break
+
+    # ---- Timing: round-trip with vs without count ----
+    for label, rts in [
+        ("without count", rts_without_count),
+        ("with count", rts_with_count),
+    ]:
         if rts:
             avg = sum(rts) / len(rts)
-            print(
+            emit(
                 f"  RT ({label}): avg={avg:.1f}ms,"
                 f" min={min(rts)}ms, max={max(rts)}ms,"
                 f" n={len(rts)}"
             )
 
-    print()
+    emit()
+    return buf.getvalue()
+
+
+def analyze_captures(captures, jobs=1):
+    """Yield reports for captures in order, using jobs worker processes."""
+    if jobs <= 1:
+        yield from map(analyze_capture, captures)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        in_flight = deque()
+        for cap in captures:
+            in_flight.append(ex.submit(analyze_capture, cap))
+            if len(in_flight) >= 2 * jobs:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="analyze captures in N worker processes (default: 1, serial)",
+    )
+    args = parser.parse_args()
+
     path = Path(__file__).parent / "decoded.txt"
     if not path.exists():
         print(f"Error: {path} not found", file=sys.stderr)
         sys.exit(1)
 
-    text = path.read_text()
-    captures = parse_captures(text)
-    print(f"Parsed {len(captures)} captures\n")
-
-    for cap in captures:
-        analyze_capture(cap)
+    count = 0
+    captures = cached_captures(path, path.with_suffix(".cache.pkl"))
+    for report in analyze_captures(captures, args.jobs):
+        print(report, end="")
+        count += 1
+    print(f"Parsed {count} captures")
 
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ This script connects to our mock server and verifies that it behaves
 correctly according to the ELM327 specification.
 """
 
+import select
 import socket
 import time
 import sys
@@ -55,26 +56,34 @@ def send_command(sock, cmd, timeout=2.0):
     """Send a command and read the response."""
     sock.sendall((cmd + "\r").encode())
     
-    response = b""
-    start = time.time()
+    response = bytearray()
+    deadline = time.monotonic() + timeout
     
     while True:
-        if time.time() - start > timeout:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
             break
-        try:
-            sock.settimeout(0.5)
-            data = sock.recv(1024)
-            if not data:
-                break
-            response += data
-            # Check for prompt
-            if b">" in response:
-                break
-        except socket.timeout:
+        # Wait for data without a per-read timeout; recv won't block once
+        # the socket is readable
+        readable, _, _ = select.select([sock], [], [], remaining)
+        if not readable:
+            break
+        data = sock.recv(4096)
+        if not data:
+            break
+        response.extend(data)
+        # Check for prompt; it's a single byte, so it can't straddle reads
+        # and only the new data needs scanning
+        if b">" in data:
             break
     
     return response.decode("utf-8", errors="replace")
 
+def skip_echo(response, cmd):
+    """Return the index just past the echoed command, or 0 if not echoed."""
+    echo = response.find(cmd)
+    return echo + len(cmd) if echo >= 0 else 0
+
 def test_at_commands(sock):
     """Test AT commands."""
     print("\n=== Testing AT Commands ===\n")
@@ -116,12 +125,14 @@ def test_obd_commands(sock):
     for cmd, prefix, pid, desc in OBD_TESTS:
         response = send_command(sock, cmd)
         
-        # Clean up response
-        response_clean = response.replace(cmd, "").strip().upper()
+        # Search past the echoed command in place, rather than building a
+        # cleaned copy of the response
+        upper = response.upper()
+        start = skip_echo(upper, cmd)
         
         # Check for expected prefix
-        has_prefix = prefix in response_clean
-        has_pid = pid is None or pid.upper() in response_clean
+        has_prefix = upper.find(prefix, start) >= 0
+        has_pid = pid is None or upper.find(pid.upper(), start) >= 0
         
         success = has_prefix and has_pid
         
@@ -129,6 +140,7 @@ def test_obd_commands(sock):
         print(f"{status}: {cmd:12} - {desc}")
         
         if not success:
+            response_clean = response.replace(cmd, "").strip().upper()
             print(f"         Expected: prefix '{prefix}', PID '{pid}'")
             print(f"         Got: '{response_clean}'")
             failed += 1
@@ -147,12 +159,14 @@ def test_multi_pid(sock):
     for cmd, prefix, pids, desc in MULTI_PID_TESTS:
         response = send_command(sock, cmd)
         
-        # Clean up response
-        response_clean = response.replace(cmd, "").strip().upper()
+        # Search past the echoed command in place, rather than building a
+        # cleaned copy of the response
+        upper = response.upper()
+        start = skip_echo(upper, cmd)
         
         # Check for expected prefix and all PIDs
-        has_prefix = prefix in response_clean
-        has_all_pids = all(pid.upper() in response_clean for pid in pids)
+        has_prefix = upper.find(prefix, start) >= 0
+        has_all_pids = all(upper.find(pid.upper(), start) >= 0 for pid in pids)
         
         success = has_prefix and has_all_pids
         
@@ -160,6 +174,7 @@ def test_multi_pid(sock):
         print(f"{status}: {cmd:12} - {desc}")
         
         if not success:
+            response_clean = response.replace(cmd, "").strip().upper()
             print(f"         Expected: prefix '{prefix}', PIDs {pids}")
             print(f"         Got: '{response_clean}'")
             failed += 1